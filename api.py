@@ -1,16 +1,47 @@
+import io
 import os
 import re
 import json
+import time
+import uuid
+import zlib
+import pickle
+import hashlib
 import sqlite3
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import fitz  # PyMuPDF for fast text scanning
-import pdfplumber
 import logging
 
 from openai import OpenAI
-from flask import Flask, request, jsonify, render_template, redirect, url_for, send_from_directory, flash
+from flask import Flask, abort, g, request, jsonify, render_template, redirect, url_for, send_from_directory, flash
+from flask.json.provider import DefaultJSONProvider
 from dotenv import load_dotenv
 
+try:
+    import ahocorasick  # pyahocorasick: C-level multi-pattern matcher
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson  # C JSON codec, several times faster than stdlib json
+except ImportError:
+    orjson = None
+
+
+def json_dumps(obj):
+    """Serializes to a str, via orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def json_loads(data):
+    """Parses JSON from str or bytes, via orjson when available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,6 +52,27 @@ logger = logging.getLogger(__name__)
 load_dotenv()  # load OPENAI_API_KEY & FLASK_SECRET from .env locally
 app = Flask(__name__, static_folder='uploads')
 app.secret_key = os.getenv('FLASK_SECRET', os.urandom(24))
+# Werkzeug rejects larger request bodies with a 413 before they are read.
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024
+
+if orjson is not None:
+    class OrjsonJSONProvider(DefaultJSONProvider):
+        """Backs jsonify and the tojson template filter with orjson, so the
+        JSON sent to clients goes through the same fast codec as the
+        internal cache/blob serialization"""
+
+        def dumps(self, obj, **kwargs):
+            option = 0
+            if kwargs.get('indent'):
+                option |= orjson.OPT_INDENT_2  # orjson only offers 2-space indent
+            if kwargs.get('sort_keys', self.sort_keys):
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=self.default, option=option).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonJSONProvider(app)
 
 client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
@@ -30,30 +82,190 @@ KEYWORDS      = [
     "Total Assets", "Total Liabilities", "Intangible Assets",
     "Profit before Tax", "Cash and balances at central banks"
 ]
+# Bump whenever KEYWORDS or the extraction prompt changes, so stale cached
+# LLM answers are never served for a new prompt shape.
+PROMPT_VERSION  = "v1"
+CACHE_TTL_DAYS  = 7
+# Separator between snippets in both the prompt and the snippet-payload
+# cache key — the two must agree or the cache tier keys drift.
+SNIPPET_SEP     = "\n---\n"
+# Upload stream read granularity.
+READ_CHUNK_SIZE = 1 << 20
+
+# Structured extraction doesn't need a frontier model; gpt-4o-mini is an
+# order of magnitude cheaper and faster. Override per deployment via env.
+EXTRACTION_MODEL = os.getenv("EXTRACTION_MODEL", "gpt-4o-mini")
+
+# Strict schema keyed by metric: the API guarantees the response parses and
+# carries every keyword, instead of hoping the prompt wording holds.
+_METRIC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "value": {"type": ["string", "null"]},
+        "unit": {"type": ["string", "null"]},
+        "year": {"type": ["integer", "null"]},
+    },
+    "required": ["value", "unit", "year"],
+    "additionalProperties": False,
+}
+EXTRACTION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "metric_extraction",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {kw: _METRIC_SCHEMA for kw in KEYWORDS},
+            "required": list(KEYWORDS),
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Compile keyword patterns once at import: a plain alternation for "does
+# this page mention anything" and a named-group alternation that lets one
+# finditer pass over the document attribute each match to its keyword, so no
+# call site pays re.escape/compile or a lowered text copy.
+KEYWORD_RE = re.compile("|".join(re.escape(k) for k in KEYWORDS), re.IGNORECASE)
+KEYWORD_GROUP_RE = re.compile(
+    "|".join(f"(?P<k{i}>{re.escape(k)})" for i, k in enumerate(KEYWORDS)),
+    re.IGNORECASE
+)
+KEYWORD_BY_GROUP = {f"k{i}": k for i, k in enumerate(KEYWORDS)}
+
+# Build the keyword automaton once at import: one Aho-Corasick pass finds
+# every keyword in O(len(text)) instead of one substring scan per keyword.
+if ahocorasick is not None:
+    KEYWORD_AUTOMATON = ahocorasick.Automaton()
+    for _kw in KEYWORDS:
+        KEYWORD_AUTOMATON.add_word(_kw.lower(), _kw)
+    KEYWORD_AUTOMATON.make_automaton()
+else:
+    KEYWORD_AUTOMATON = None
+
+
+def page_has_keyword(text):
+    """True if any keyword occurs in the page text (case-insensitive)"""
+    if KEYWORD_AUTOMATON is not None:
+        return next(KEYWORD_AUTOMATON.iter(text.lower()), None) is not None
+    return KEYWORD_RE.search(text) is not None
+
+# On-disk cache of parsed (raw_text, table_rows) keyed by file hash plus
+# PROMPT_VERSION: the parse output depends on KEYWORDS too (only matching
+# pages are kept, and tables are skipped when the text layer covers the
+# keyword set), so a keyword change must invalidate it just like llm_cache.
+# Within one version, re-processing the same PDF skips the parse entirely.
+PARSE_CACHE_DIR       = 'parse_cache'
+PARSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
 logger.info("Initialized app with upload folder '%s' and DB '%s'", UPLOAD_FOLDER, DB_PATH)
 
 # ——————————————————————————————————————————————————————————————————————
 #  B) Database helpers (SQLite)
 # ——————————————————————————————————————————————————————————————————————
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+# WAL lets readers proceed while a write is in flight; synchronous=NORMAL
+# drops the per-commit fsync that FULL pays (safe under WAL); the rest keep
+# hot pages and temp structures in memory and retry instead of failing with
+# SQLITE_BUSY under concurrent requests.
+SQLITE_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA busy_timeout=5000;
+    PRAGMA cache_size=-20000;
+    PRAGMA temp_store=memory;
+    PRAGMA mmap_size=268435456;
+"""
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.executescript(SQLITE_PRAGMAS)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def get_db():
+    """Returns the request-scoped connection, opening it on first use"""
+    if 'db' not in g:
+        g.db = _connect()
+    return g.db
+
+
+@app.teardown_appcontext
+def close_db(exc):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+
+def pack_results(results):
+    """Serializes and compresses a results dict for storage"""
+    return zlib.compress(json_dumps(results).encode(), 6)
+
+
+def unpack_results(stored):
+    """Inverse of pack_results; tolerates uncompressed rows from older DBs"""
+    if isinstance(stored, bytes):
+        return json_loads(zlib.decompress(stored))
+    return json_loads(stored)
+
+
+@contextmanager
+def tx(db):
+    """Runs a unit of work in one BEGIN IMMEDIATE transaction.
+
+    Connections are in autocommit mode, so multi-statement work would
+    otherwise fsync per statement; grabbing the write lock up front also
+    avoids a mid-transaction SQLITE_BUSY upgrade.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+
 def init_db():
-    db = get_db()
+    # Runs at import, outside any request context, so it gets its own
+    # short-lived connection instead of going through flask.g.
+    db = _connect()
     db.execute(
         '''CREATE TABLE IF NOT EXISTS extracted_reports (
               id INTEGER PRIMARY KEY AUTOINCREMENT,
               filename TEXT NOT NULL,
-              result_json TEXT NOT NULL,
+              result_json BLOB NOT NULL,
+              content_sha TEXT,
               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
            )'''
     )
+    try:
+        db.execute("ALTER TABLE extracted_reports ADD COLUMN content_sha TEXT")
+    except sqlite3.OperationalError:
+        pass  # column already exists on databases created before it was added
+    db.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_sha"
+        " ON extracted_reports(content_sha)"
+    )
+    db.execute(
+        '''CREATE TABLE IF NOT EXISTS llm_cache (
+              input_hash TEXT NOT NULL,
+              prompt_version TEXT NOT NULL,
+              result_json TEXT NOT NULL,
+              created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+              expires_at TIMESTAMP,
+              PRIMARY KEY (input_hash, prompt_version)
+           )'''
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reports_created"
+        " ON extracted_reports(created_at DESC)"
+    )
     db.commit()
+    db.close()
     logger.info("Database initialized and table ensured.")
 
 init_db()
@@ -61,81 +273,281 @@ init_db()
 # ——————————————————————————————————————————————————————————————————————
 #  C) Two-phase PDF extraction logic
 # ——————————————————————————————————————————————————————————————————————
-def find_relevant_pages(pdf_path, keywords):
+def get_cached_results(input_hash):
+    """Returns cached LLM results for this PDF hash, or None"""
+    db = get_db()
+    rec = db.execute(
+        "SELECT result_json FROM llm_cache WHERE input_hash=? AND prompt_version=?"
+        " AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)",
+        (input_hash, PROMPT_VERSION)
+    ).fetchone()
+    if rec:
+        logger.info("LLM cache hit for hash %s", input_hash)
+        return json_loads(rec['result_json'])
+    return None
+
+
+def store_cached_results(input_hash, results):
+    """Stores LLM results in the cache keyed by PDF hash + prompt version"""
+    db = get_db()
+    db.execute(
+        "INSERT OR REPLACE INTO llm_cache (input_hash, prompt_version, result_json, expires_at)"
+        " VALUES (?, ?, ?, datetime('now', ?))",
+        (input_hash, PROMPT_VERSION, json_dumps(results), f'+{CACHE_TTL_DAYS} days')
+    )
+
+
+def _parse_cache_path(input_hash):
+    return os.path.join(PARSE_CACHE_DIR, f"{input_hash}-{PROMPT_VERSION}.pkl.z")
+
+
+def load_parsed(input_hash):
+    """Returns cached (raw_text, table_rows) for this PDF hash, or None"""
+    try:
+        with open(_parse_cache_path(input_hash), 'rb') as fh:
+            raw_text, table_rows = pickle.loads(zlib.decompress(fh.read()))
+    except (OSError, zlib.error, pickle.UnpicklingError, ValueError):
+        return None
+    logger.info("Parse cache hit for hash %s", input_hash)
+    return raw_text, table_rows
+
+
+def store_parsed(input_hash, raw_text, table_rows):
+    """Writes parsed content to the disk cache and evicts least-recently-used
+    entries once the cache directory exceeds its size budget"""
+    with open(_parse_cache_path(input_hash), 'wb') as fh:
+        fh.write(zlib.compress(pickle.dumps((raw_text, table_rows)), 6))
+
+    entries = []
+    for name in os.listdir(PARSE_CACHE_DIR):
+        path = os.path.join(PARSE_CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_atime, st.st_size, path))
+    excess = sum(size for _, size, _ in entries) - PARSE_CACHE_MAX_BYTES
+    for _, size, path in sorted(entries):
+        if excess <= 0:
+            break
+        try:
+            os.remove(path)
+            excess -= size
+            logger.info("Evicted parse cache entry %s", path)
+        except OSError:
+            pass
+
+
+# Below this page count the thread-pool overhead outweighs the scan itself.
+PHASE1_PARALLEL_THRESHOLD = 16
+
+
+def _scan_page_range(data, page_range):
+    """Scans a span of pages for keywords in a worker-local Document.
+
+    fitz documents are not thread-safe, but opening one from bytes already
+    in RAM is cheap, so each worker gets its own. Returns (index, text)
+    pairs for matching pages so Phase 2 never re-extracts them.
+    """
+    doc = fitz.open(stream=data, filetype='pdf')
+    try:
+        hits = []
+        for i in page_range:
+            text = doc.load_page(i).get_text() or ""
+            if page_has_keyword(text):
+                hits.append((i, text))
+        return hits
+    finally:
+        doc.close()
+
+
+def find_relevant_pages(data, keywords):
     """
-    Phase 1: fast, text-only scan using PyMuPD to flag pages containing keywords
+    Phase 1: fast, text-only scan using PyMuPD to flag pages containing keywords.
+
+    Returns (hit_pages, page_texts) where page_texts maps page index to the
+    text already extracted during the scan.
     """
-    logger.info("Phase 1: Scanning PDF '%s' for keywords %s", pdf_path, keywords)
-    doc = fitz.open(pdf_path)
-    keyset = [k.lower() for k in keywords]
-    hits = []
-    for i, page in enumerate(doc):
-        text = page.get_text() or ""
-        if any(k in text.lower() for k in keyset):
-            hits.append(i)
+    logger.info("Phase 1: Scanning PDF for keywords %s", keywords)
+    doc = fitz.open(stream=data, filetype='pdf')
+    page_count = doc.page_count
     doc.close()
+
+    workers = min(os.cpu_count() or 1, 8)
+    if page_count < PHASE1_PARALLEL_THRESHOLD or workers == 1:
+        matches = _scan_page_range(data, range(page_count))
+    else:
+        # PyMuPDF releases the GIL inside text extraction, so splitting the
+        # page range across threads scales close to linearly with cores.
+        step = -(-page_count // workers)
+        ranges = [range(start, min(start + step, page_count))
+                  for start in range(0, page_count, step)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            matches = sorted(
+                hit for chunk in executor.map(lambda r: _scan_page_range(data, r), ranges)
+                for hit in chunk
+            )
+    hits = [i for i, _ in matches]
+    page_texts = dict(matches)
     logger.info("Phase 1 complete: found %d relevant pages: %s", len(hits), hits)
-    return hits
+    return hits, page_texts
+
 
+# Table detection is far heavier per page than the Phase-1 text scan, so it
+# pays to fan out at a much lower page count.
+PHASE2_PARALLEL_THRESHOLD = 4
 
-def extract_page_content(pdf_path, hit_pages):
+
+def _extract_tables_range(data, pages):
+    """Extracts table rows for a span of hit pages in a worker-local Document"""
+    doc = fitz.open(stream=data, filetype='pdf')
+    try:
+        out = []
+        for idx in pages:
+            logger.info("Parsing page %d", idx)
+            page = doc.load_page(idx)
+            # list comp instead of a genexp: str.join materializes a genexp
+            # into a list internally anyway, and this is the hottest loop of
+            # Phase 2.
+            page_rows = [
+                " | ".join([cell or "" for cell in row])
+                for table in page.find_tables().tables
+                for row in table.extract()
+            ]
+            out.append((idx, page_rows))
+        return out
+    finally:
+        doc.close()
+
+
+def extract_page_content(data, hit_pages, page_texts):
     """
-    Phase 2: heavy parsing (text + tables) only on flagged pages via pdfplumber
+    Phase 2: table parsing only on flagged pages via PyMuPDF.
+
+    Page text was already extracted during the Phase-1 scan and is reused
+    from page_texts, so this pass only pays for table detection. Pages are
+    independent, so detection fans out over a thread pool with one Document
+    per worker, same as the Phase-1 scan.
     """
-    logger.info("Phase 2: Parsing content on flagged pages of '%s'", pdf_path)
-    raw_text = []
+    logger.info("Phase 2: Parsing tables on flagged pages")
+    doc = fitz.open(stream=data, filetype='pdf')
+    page_count = doc.page_count
+    doc.close()
+    valid_pages = [i for i in hit_pages if i < page_count]
+
+    workers = min(os.cpu_count() or 1, 8, max(len(valid_pages), 1))
+    if len(valid_pages) < PHASE2_PARALLEL_THRESHOLD or workers == 1:
+        extracted = _extract_tables_range(data, valid_pages)
+    else:
+        chunks = [valid_pages[i::workers] for i in range(workers)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            extracted = sorted(
+                item for chunk in executor.map(lambda p: _extract_tables_range(data, p), chunks)
+                for item in chunk
+            )
+
+    raw_text = [page_texts.get(idx) or "" for idx in valid_pages]
     table_rows = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for idx in hit_pages:
-            if idx < len(pdf.pages):
-                logger.info("Parsing page %d", idx)
-                page = pdf.pages[idx]
-                text = page.extract_text() or ""
-                raw_text.append(text)
-                for table in page.extract_tables():
-                    for row in table:
-                        table_rows.append(" | ".join(cell or "" for cell in row))
+    for _, page_rows in extracted:
+        table_rows.extend(page_rows)
     logger.info("Phase 2 complete: extracted %d text blocks and %d table rows", len(raw_text), len(table_rows))
     return "\n".join(raw_text), table_rows
 
 
-def find_contexts(text, keyword, window_chars=200):
-    """Extracts text snippets around each occurrence of keyword"""
-    contexts = []
-    for m in re.finditer(re.escape(keyword), text, re.IGNORECASE):
-        start = max(0, m.start() - window_chars)
-        end = m.end() + window_chars
-        contexts.append(text[start:end])
+_WS_RE = re.compile(r"\s+")
+
+
+def find_contexts(text, max_contexts, window_chars=200):
+    """Extracts text snippets around keyword occurrences, bucketed by keyword.
+
+    A single pass finds every keyword at once instead of one full scan of
+    the text per keyword: the Aho-Corasick automaton (a C-level pass over
+    one lowered copy) when pyahocorasick is installed, otherwise the
+    named-group alternation regex. Either scan stops early once
+    max_contexts matches are collected. Overlapping windows for the same
+    keyword are merged into one snippet and whitespace runs are collapsed,
+    so dense keyword clusters don't bloat the prompt with near-duplicates.
+    """
+    spans = {kw: [] for kw in KEYWORDS}
+    total = 0
+    if KEYWORD_AUTOMATON is not None:
+        for end, kw in KEYWORD_AUTOMATON.iter(text.lower()):
+            start = max(0, end + 1 - len(kw) - window_chars)
+            spans[kw].append([start, end + 1 + window_chars])
+            total += 1
+            if total >= max_contexts:
+                break
+    else:
+        for m in KEYWORD_GROUP_RE.finditer(text):
+            kw = KEYWORD_BY_GROUP[m.lastgroup]
+            spans[kw].append([max(0, m.start() - window_chars), m.end() + window_chars])
+            total += 1
+            if total >= max_contexts:
+                break
+
+    contexts = {}
+    for kw, kw_spans in spans.items():
+        # Spans arrive in scan order, i.e. sorted by start; classic interval
+        # merge collapses overlapping/adjacent windows.
+        merged = []
+        for span in kw_spans:
+            if merged and span[0] <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], span[1])
+            else:
+                merged.append(span)
+        contexts[kw] = [_WS_RE.sub(" ", text[start:end]) for start, end in merged]
     return contexts
 
 
-def find_table_rows(table_rows, keyword):
-    """Filters table rows that contain the keyword"""
-    return [row for row in table_rows if keyword.lower() in row.lower()]
+def text_covers_all_keywords(text):
+    """True if every keyword appears somewhere in the text layer"""
+    seen = set()
+    for m in KEYWORD_GROUP_RE.finditer(text):
+        seen.add(m.lastgroup)
+        if len(seen) == len(KEYWORDS):
+            return True
+    return False
+
+
+def find_table_rows(table_rows, rows_lower, kw_lower):
+    """Filters table rows whose lowered form contains the lowered keyword"""
+    return [row for row, low in zip(table_rows, rows_lower) if kw_lower in low]
 
 
 def prepare_snippets(raw_text, table_rows, max_snippets=20):
     """Combines context snippets and table rows for AI input"""
+    contexts = find_contexts(raw_text, max_snippets)
+    # Lowercase the row corpus once instead of once per keyword inside
+    # find_table_rows.
+    rows_lower = [row.lower() for row in table_rows]
     snippets = []
     for kw in KEYWORDS:
-        snippets.extend(find_contexts(raw_text, kw))
-        snippets.extend(find_table_rows(table_rows, kw))
         if len(snippets) >= max_snippets:
             break
+        snippets.extend(contexts[kw])
+        snippets.extend(find_table_rows(table_rows, rows_lower, kw.lower()))
+    # A table row matching several keywords (or two keywords sharing a
+    # context window) shows up once per keyword; dict.fromkeys drops the
+    # duplicates while keeping insertion order.
+    snippets = list(dict.fromkeys(snippets))
     logger.info("Prepared %d snippets for AI extraction", len(snippets))
     return snippets[:max_snippets]
 
 
-def call_ai(kw, snippets):
-    """Sends snippets to OpenAI and returns parsed JSON result"""
-    logger.info("Calling AI for keyword '%s' with %d snippets", kw, len(snippets))
+def call_ai_batch(keywords, snippets):
+    """Sends snippets to OpenAI once and returns results for all keywords"""
+    logger.info("Calling AI for %d keywords with %d snippets", len(keywords), len(snippets))
     prompt = (
-        f"Extract the value, unit & year for '{kw}' from the snippets below. "
-        "Reply ONLY with JSON: {\"metric\":...,\"value\":...,\"unit\":...,\"year\":...}\n\n"
-        + "\n---\n".join(snippets)
+        "Extract the value, unit & year for each of these metrics: "
+        + ", ".join(f"'{kw}'" for kw in keywords)
+        + " from the snippets below. Reply ONLY with a JSON object keyed by "
+        "metric name, e.g. {\"Total Assets\": {\"value\":...,\"unit\":...,\"year\":...}, ...}\n\n"
+        + SNIPPET_SEP.join(snippets)
     )
     resp = client.chat.completions.create(
-        model="gpt-4",
+        model=EXTRACTION_MODEL,
+        response_format=EXTRACTION_RESPONSE_FORMAT,
+        temperature=0,
         messages=[
             {"role": "system", "content": "You are a financial data extractor."},
             {"role": "user", "content": prompt}
@@ -143,15 +555,122 @@ def call_ai(kw, snippets):
     )
     text = resp.choices[0].message.content.strip()
     try:
-        result = json.loads(text)
-        logger.info("AI result for '%s': %s", kw, result)
-        return result
-    except json.JSONDecodeError:
-        logger.error("Failed to parse JSON for '%s': %s", kw, text)
+        parsed = json_loads(text)
+    except ValueError:
+        logger.error("Failed to parse JSON batch response: %s", text)
         return {"error": "Invalid JSON", "raw": text}
+    # Fan out so every requested metric has an entry, even if the model
+    # skipped one — downstream code and templates rely on the keys.
+    results = {kw: parsed.get(kw, {"error": "Not found in response"}) for kw in keywords}
+    logger.info("AI results for %d metrics: %s", len(results), results)
+    return results
+
+
+def is_error_result(results):
+    """True for the error shape call_ai_batch returns on an unparseable response"""
+    return "error" in results
+
+# ——————————————————————————————————————————————————————————————————————
+#  D) Background extraction jobs
+# ——————————————————————————————————————————————————————————————————————
+# A full extraction can hold an HTTP worker for tens of seconds (PDF parse
+# plus the LLM round-trip), serializing the whole server. Uploads are
+# handed to this in-process pool instead and the client polls /status.
+# Finished entries stay in _jobs until the TTL sweep so a refresh of the
+# status page keeps redirecting instead of 404ing; the sweep on each
+# enqueue keeps the store bounded even for jobs nobody polls.
+JOB_TTL_SECONDS = 30 * 60
+
+_job_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='extract')
+_jobs = {}  # job_id -> {'future': Future, 'created_at': epoch seconds}
+
+
+def _prune_jobs():
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for job_id, job in list(_jobs.items()):
+        if job['created_at'] < cutoff and job['future'].done():
+            _jobs.pop(job_id, None)
+            logger.info("Pruned expired extraction job %s", job_id)
+
+
+def process_pdf(data, input_hash, filename):
+    """Runs the extraction pipeline for one upload; returns the report id.
+
+    Returns None when no page matches any keyword. Runs on a pool thread,
+    so it pushes its own app context for flask.g / teardown handling.
+    """
+    with app.app_context():
+        results = get_cached_results(input_hash)
+
+        if results is None:
+            parsed = load_parsed(input_hash)
+            if parsed is not None:
+                raw_text, table_rows = parsed
+            else:
+                # Two-phase extraction
+                hit_pages, page_texts = find_relevant_pages(data, KEYWORDS)
+                if not hit_pages:
+                    logger.warning("No pages matched keywords for '%s'", filename)
+                    return None
+
+                # Table detection is the heaviest remaining step; skip it
+                # when the text layer alone already mentions every keyword,
+                # and only fall back to Phase 2 when something is
+                # table-bound.
+                raw_text = "\n".join(page_texts[i] for i in hit_pages)
+                table_rows = []
+                if not text_covers_all_keywords(raw_text):
+                    raw_text, table_rows = extract_page_content(data, hit_pages, page_texts)
+                store_parsed(input_hash, raw_text, table_rows)
+            snippets = prepare_snippets(raw_text, table_rows)
+
+            # Second cache tier: key on the snippet payload itself. Reports
+            # that differ only in irrelevant pages (boilerplate, re-exports)
+            # produce identical snippets, so they reuse the LLM answer even
+            # though the file hashes differ.
+            snippets_hash = hashlib.blake2b(
+                SNIPPET_SEP.join(snippets).encode(), digest_size=16
+            ).hexdigest()
+            results = get_cached_results(snippets_hash)
+
+            if results is None:
+                # One batched request for all metrics: the snippet payload is
+                # shared anyway, so this pays the prompt tokens once and a
+                # single round-trip instead of one per keyword.
+                results = call_ai_batch(KEYWORDS, snippets)
+                if not is_error_result(results):
+                    store_cached_results(snippets_hash, results)
+            if not is_error_result(results):
+                store_cached_results(input_hash, results)
+
+        # Store in DB. Error results get no content_sha so the dedupe check
+        # never pins future uploads of the same file to a broken report —
+        # re-uploading stays a valid retry path.
+        content_sha = None if is_error_result(results) else input_hash
+        db = get_db()
+        try:
+            with tx(db):
+                cur = db.execute(
+                    "INSERT INTO extracted_reports (filename, result_json, content_sha) VALUES (?, ?, ?)",
+                    (filename, pack_results(results), content_sha))
+            rec_id = cur.lastrowid
+        except sqlite3.IntegrityError:
+            # Two concurrent uploads of identical bytes can both pass the
+            # pre-insert dedupe check; the loser reuses the winner's report.
+            existing = db.execute(
+                "SELECT id FROM extracted_reports WHERE content_sha=?", (input_hash,)
+            ).fetchone()
+            if existing is None:
+                raise
+            rec_id = existing['id']
+            logger.info("Concurrent duplicate of '%s'; reusing report %d", filename, rec_id)
+            return rec_id
+        logger.info("Stored results for '%s' as record %d", filename, rec_id)
+        return rec_id
+
 
 # ——————————————————————————————————————————————————————————————————————
-#  D) Routes (upload, results, download)
+#  E) Routes (upload, status, results, download)
 # ——————————————————————————————————————————————————————————————————————
 @app.route('/', methods=['GET','POST'])
 def upload():
@@ -164,48 +683,85 @@ def upload():
         filename = f.filename
         logger.info("Received upload for file '%s'", filename)
 
-        # Save upload to a temp file
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        pdf_path = tmp.name
-        tmp.close()
-        f.save(pdf_path)
-        logger.info("Saved file to '%s'", pdf_path)
-
-        # Two-phase extraction
-        hit_pages = find_relevant_pages(pdf_path, KEYWORDS)
-        if not hit_pages:
-            os.remove(pdf_path)
-            flash("No relevant pages found.")
-            logger.warning("No pages matched keywords for '%s'", filename)
-            return redirect(url_for('upload'))
-
-        raw_text, table_rows = extract_page_content(pdf_path, hit_pages)
-        snippets = prepare_snippets(raw_text, table_rows)
-        results = {kw: call_ai(kw, snippets) for kw in KEYWORDS}
-
-        # Store in DB
+        # Cheap validation before any parsing: a wrong mimetype or missing
+        # %PDF- magic means PyMuPDF would churn on garbage for nothing.
+        magic = f.stream.read(5)
+        f.stream.seek(0)
+        if f.mimetype != 'application/pdf' or magic != b'%PDF-':
+            logger.warning("Rejected non-PDF upload '%s' (mimetype %s)", filename, f.mimetype)
+            abort(415, "Only PDF uploads are accepted.")
+
+        # Keep the upload in memory: fitz accepts a byte stream, so there is
+        # no need for a temp-file round-trip through disk. Reading in 1MB
+        # chunks feeds the hash as the bytes arrive, so the cache key costs
+        # no second pass over the file.
+        hasher = hashlib.sha256()
+        buf = io.BytesIO()
+        for chunk in iter(lambda: f.stream.read(READ_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+            buf.write(chunk)
+        data = buf.getvalue()
+        input_hash = hasher.hexdigest()
+        logger.info("Read %d bytes for '%s'", len(data), filename)
+
+        # Exact re-upload of an already-processed file: don't create another
+        # report row, just send the user to the existing one.
         db = get_db()
-        db.execute("INSERT INTO extracted_reports (filename, result_json) VALUES (?, ?)",
-                   (filename, json.dumps(results)))
-        db.commit()
-        rec_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
-        logger.info("Stored results for '%s' as record %d", filename, rec_id)
-
-        os.remove(pdf_path)
-        return redirect(url_for('show_result', report_id=rec_id))
+        existing = db.execute(
+            "SELECT id FROM extracted_reports WHERE content_sha=?", (input_hash,)
+        ).fetchone()
+        if existing:
+            logger.info("Duplicate upload of '%s'; reusing report %d", filename, existing['id'])
+            return redirect(url_for('show_result', report_id=existing['id']))
+
+        # Hand the slow pipeline to the background pool and let the client
+        # poll; the HTTP worker is free again in milliseconds.
+        _prune_jobs()
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            'future': _job_executor.submit(process_pdf, data, input_hash, filename),
+            'created_at': time.time(),
+        }
+        logger.info("Enqueued extraction job %s for '%s'", job_id, filename)
+        return redirect(url_for('job_status', job_id=job_id))
 
     # GET: show upload form + history
     db = get_db()
-    db.row_factory = sqlite3.Row
-    past = db.execute("SELECT * FROM extracted_reports ORDER BY created_at DESC").fetchall()
+    # No result_json here: the list page doesn't render it, and skipping the
+    # blobs keeps the query inside the index pages.
+    past = db.execute(
+        "SELECT id, filename, created_at FROM extracted_reports"
+        " ORDER BY created_at DESC LIMIT 50"
+    ).fetchall()
     return render_template('upload.html', past=past)
 
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    job = _jobs.get(job_id)
+    if job is None:
+        abort(404)
+    future = job['future']
+    if not future.done():
+        return render_template('status.html', job_id=job_id)
+    # Leave the entry for the TTL sweep: a refresh or back-button visit of
+    # this URL should redirect again, not 404.
+    try:
+        rec_id = future.result()
+    except Exception:
+        logger.exception("Extraction job %s failed", job_id)
+        flash("Extraction failed; please try again.")
+        return redirect(url_for('upload'))
+    if rec_id is None:
+        flash("No relevant pages found.")
+        return redirect(url_for('upload'))
+    return redirect(url_for('show_result', report_id=rec_id))
+
+
 @app.route('/results/<int:report_id>')
 def show_result(report_id):
     db = get_db()
-    db.row_factory = sqlite3.Row
     rec = db.execute("SELECT * FROM extracted_reports WHERE id=?", (report_id,)).fetchone()
-    data = json.loads(rec['result_json'])
+    data = unpack_results(rec['result_json'])
     logger.info("Displaying results for record %d", report_id)
     return render_template('results.html', filename=rec['filename'], data=data)
 
@@ -215,5 +771,6 @@ def download_file(filename):
     return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=True)
 
 if __name__ == '__main__':
-    logger.info("Starting Flask app")
+    # Dev server only; deploy with `gunicorn -c gunicorn_conf.py api:app`.
+    logger.info("Starting Flask dev server")
     app.run(host='0.0.0.0', port=5000, debug=True)
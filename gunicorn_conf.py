@@ -0,0 +1,13 @@
+# gthread workers let OpenAI/network waits overlap across requests instead
+# of serializing uploads behind the dev server's single thread.
+# Run with: gunicorn -c gunicorn_conf.py api:app
+bind = '0.0.0.0:5000'
+# Single process: the background job store (_jobs in api.py) is in-memory
+# and per-process, so /status polls must land on the process that enqueued
+# the job. The threads below provide the request concurrency, and the
+# heavy extraction work runs in the app's own background pool.
+workers = 1
+worker_class = 'gthread'
+threads = 16
+# Extraction runs in the background pool, but give slow PDF parses headroom.
+timeout = 120